@@ -1,4 +1,9 @@
 import os
+import math
+import asyncio
+import random
+import threading
+import time
 import joblib
 import datetime
 import numpy as np
@@ -6,9 +11,20 @@ import pandas as pd
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 import firebase_admin
 from firebase_admin import credentials, db
 
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    # numba is optional: fall back to plain Python kernels
+    HAS_NUMBA = False
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]): return args[0]
+        return lambda fn: fn
+
 # 1. CONFIGURATION & SETUP
 load_dotenv()
 DB_URL = os.getenv("FIREBASE_DB_URL")
@@ -29,7 +45,7 @@ POLICY_CONFIG = {
 if not DB_URL or not CRED_PATH:
     raise RuntimeError("Error: Missing Firebase configuration variables in .env file.")
 
-app = FastAPI(title="Smart Garden Control API", version="3.4.2 (Smart Logging)")
+app = FastAPI(title="Smart Garden Control API", version="3.4.2 (Smart Logging)", default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -48,6 +64,16 @@ if not firebase_admin._apps:
     except Exception as e:
         print(f"System Error: Firebase connection failed - {e}")
 
+# Shared database references (built once, reused by every request)
+LIVE_PATH = 'sensors/greenhouse_1/live_status'
+HIST_PATH = 'sensors/greenhouse_1/history_logs'
+DEC_PATH = 'sensors/greenhouse_1/decision_logs'
+ROOT_REF = LIVE_REF = HIST_REF = None
+if firebase_admin._apps:
+    ROOT_REF = db.reference('/')
+    LIVE_REF = db.reference(LIVE_PATH)
+    HIST_REF = db.reference(HIST_PATH)
+
 # 2. AI MODEL LOADER
 ai_resources = {}
 
@@ -65,6 +91,10 @@ def load_ai_models():
             print("Model does not store feature names. Using default fallback.")
             ai_resources['features'] = ["VPD_kPa", "soil_moisture_frac", "temperature_C", "humidity_RH"] 
 
+        # Reusable 1 x F input buffer, overwritten in place on every prediction
+        ai_resources['scratch'] = np.empty((1, len(ai_resources['features'])), dtype=np.float32)
+        ai_resources['feat_index'] = {name: i for i, name in enumerate(ai_resources['features'])}
+
         print("System: AI Models loaded successfully.")
     except Exception as e:
         print(f"System Error: Failed to load .pkl model - {e}")
@@ -73,24 +103,68 @@ load_ai_models()
 
 # 3. HELPER FUNCTIONS
 
+# Cyclical hour-of-day encodings, precomputed for the 24 possible hours
+_HOUR_SIN = np.sin(2 * np.pi * np.arange(24) / 24).astype(np.float32)
+_HOUR_COS = np.cos(2 * np.pi * np.arange(24) / 24).astype(np.float32)
+
+PUSH_CHARS = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+
+def generate_push_id():
+    """Generates a chronologically sortable Firebase-style push key without a server round-trip."""
+    now = int(time.time() * 1000)
+    time_chars = []
+    for _ in range(8):
+        time_chars.append(PUSH_CHARS[now % 64])
+        now //= 64
+    return ''.join(reversed(time_chars)) + ''.join(random.choice(PUSH_CHARS) for _ in range(12))
+
+def calculate_vpd_vec(t, rh):
+    """Vectorized VPD (kPa) over arrays of temperature (C) and relative humidity (%)."""
+    svp = 0.6108 * np.exp(17.27 * t / (t + 237.3))
+    return np.clip(svp * (1 - rh / 100.0), 0.0, None)
+
+@njit(cache=True)
+def _vpd(t, rh):
+    svp = 0.6108 * math.exp(17.27 * t / (t + 237.3))
+    return max(0.0, svp * (1 - rh / 100.0))
+
+@njit(cache=True)
+def _dynamic_threshold(vpd, vpd_low, vpd_high, thr_lo, thr_mid, thr_hi):
+    if vpd < vpd_low: return thr_lo
+    elif vpd < vpd_high: return thr_mid
+    else: return thr_hi
+
 def calculate_vpd(temp_c, rh_percent):
     """Calculates Vapor Pressure Deficit (VPD) in kPa."""
     if temp_c is None or rh_percent is None: return 0.0
-    svp = 0.6108 * np.exp((17.27 * temp_c) / (temp_c + 237.3))
-    vpd = svp * (1 - (rh_percent / 100.0))
-    return max(0.0, vpd)
+    return _vpd(float(temp_c), float(rh_percent))
 
 def compute_dynamic_threshold(vpd, config):
     """Determines the irrigation threshold based on current VPD."""
-    if vpd < config["vpd_low"]: return config["thr_lo"]
-    elif vpd < config["vpd_high"]: return config["thr_mid"]
-    else: return config["thr_hi"]
+    return _dynamic_threshold(float(vpd), config["vpd_low"], config["vpd_high"],
+                              config["thr_lo"], config["thr_mid"], config["thr_hi"])
+
+def compute_dynamic_threshold_vec(vpd, config):
+    """Vectorized compute_dynamic_threshold for batch evaluation (e.g. backtests over history)."""
+    vpd = np.asarray(vpd)
+    conds = [vpd < config["vpd_low"], vpd < config["vpd_high"]]
+    choices = [config["thr_lo"], config["thr_mid"]]
+    return np.select(conds, choices, default=config["thr_hi"])
+
+def apply_njit(df: pd.DataFrame, fn) -> pd.Series:
+    """Row-wise apply for UDFs that cannot be vectorized, compiled by pandas' numba engine.
 
-def process_historical_data(hist_df: pd.DataFrame, feature_list: list) -> pd.DataFrame:
-    """Preprocesses data to match exactly what the .pkl model expects."""
-    df = hist_df.copy()
+    fn receives each row as a 1-D ndarray (raw=True), so df must be numeric.
+    Falls back to a plain apply when numba is not installed.
+    """
+    if not HAS_NUMBA:
+        return df.apply(fn, axis=1, raw=True)
+    return df.apply(fn, axis=1, raw=True, engine='numba', engine_kwargs={'nopython': True})
+
+def process_historical_data(hist_df: pd.DataFrame, feat_index: dict, out: np.ndarray) -> np.ndarray:
+    """Preprocesses data into the 1 x F feature vector the .pkl model expects, written in place into out."""
     rename_map = {'temperature': 'temperature_C', 'humidity': 'humidity_RH', 'temp': 'temperature_C', 'humid': 'humidity_RH'}
-    df.rename(columns=rename_map, inplace=True)
+    df = hist_df.rename(columns=rename_map)
     
     if 'soil_moisture_frac' not in df.columns:
         if 'soilPercent' in df.columns:
@@ -99,42 +173,105 @@ def process_historical_data(hist_df: pd.DataFrame, feature_list: list) -> pd.Dat
             df['soil_moisture_frac'] = df['soil_moisture_percent']
 
     if 'timestamp' not in df.columns: df = df.reset_index()
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-    df = df.sort_values('timestamp')
+    # Rows arrive in Firebase key order (push-ids are chronological), so no re-sort is needed
+
+    if 'temperature_C' in df.columns and 'humidity_RH' in df.columns:
+        df['VPD_kPa'] = calculate_vpd_vec(df['temperature_C'].to_numpy(dtype=np.float32),
+                                          df['humidity_RH'].to_numpy(dtype=np.float32))
+    else:
+        df['VPD_kPa'] = 0.0
 
-    df['VPD_kPa'] = df.apply(lambda row: calculate_vpd(row.get('temperature_C'), row.get('humidity_RH')), axis=1)
+    # Only the last row is consumed, so time/lag/rolling/diff features are computed as scalars
+    features_dict = df.iloc[-1].to_dict()
 
-    df["hour"] = df["timestamp"].dt.hour
-    df["sin_hour"] = np.sin(2 * np.pi * df["hour"] / 24)
-    df["cos_hour"] = np.cos(2 * np.pi * df["hour"] / 24)
+    hour = datetime.datetime.fromisoformat(str(features_dict['timestamp'])).hour
+    features_dict["hour"] = hour
+    features_dict["sin_hour"] = _HOUR_SIN[hour]
+    features_dict["cos_hour"] = _HOUR_COS[hour]
 
+    sm = df["soil_moisture_frac"].to_numpy(dtype=np.float64)
     for k in [1, 3, 6, 12, 24, 48]:
-        df[f"sm_lag{k}"] = df["soil_moisture_frac"].shift(k)
+        features_dict[f"sm_lag{k}"] = sm[-1 - k] if len(sm) > k else np.nan
     for w in [3, 6, 12, 24]:
-        df[f"sm_roll{w}"] = df["soil_moisture_frac"].rolling(w).mean()
-    df["sm_diff1"] = df["soil_moisture_frac"].diff(1)
-    df["sm_diff3"] = df["soil_moisture_frac"].diff(3)
-
-    try:
-        last_row = df.iloc[[-1]][feature_list]
-    except KeyError:
-        missing_cols = list(set(feature_list) - set(df.columns))
-        for col in missing_cols: df[col] = 0
-        last_row = df.iloc[[-1]][feature_list]
+        features_dict[f"sm_roll{w}"] = sm[-w:].mean() if len(sm) >= w else np.nan
+    for k in [1, 3]:
+        features_dict[f"sm_diff{k}"] = sm[-1] - sm[-1 - k] if len(sm) > k else np.nan
 
-    if last_row.isna().any().any():
-        last_row = last_row.fillna(method='ffill').fillna(0)
-    return last_row
+    for name, i in feat_index.items():
+        out[0, i] = features_dict.get(name, 0.0)
+    np.nan_to_num(out, nan=0.0, copy=False)
+    return out
 
 def validate_data_freshness(data_dict):
     """Checks if data is recent (< 120 seconds)."""
     if not data_dict or 'timestamp' not in data_dict: return False, None
     try:
-        last_update = pd.to_datetime(data_dict['timestamp'])
-        diff = (datetime.datetime.now() - last_update).total_seconds()
+        ts = data_dict['timestamp']
+        try:
+            last_update = float(ts)  # epoch seconds
+        except (ValueError, TypeError):
+            last_update = datetime.datetime.fromisoformat(ts).timestamp()
+        diff = time.time() - last_update
         return (True, diff) if diff < 120 else (False, diff)
     except: return False, 9999
 
+# --- LIVE STATUS CACHE ---
+# Coalesces burst polling from several dashboard tabs into one RTDB read per window
+LIVE_CACHE_TTL = 0.5
+_live_cache = {"t": 0.0, "v": None}
+# Only one refresh runs at a time; requests arriving mid-refresh wait for it and reuse its result
+_live_lock = asyncio.Lock()
+
+async def _get_live_cached():
+    """Returns live_status, reading RTDB at most once per LIVE_CACHE_TTL."""
+    if time.monotonic() - _live_cache["t"] < LIVE_CACHE_TTL:
+        return _live_cache["v"]
+    async with _live_lock:
+        if time.monotonic() - _live_cache["t"] < LIVE_CACHE_TTL:
+            return _live_cache["v"]
+        data = await asyncio.to_thread(LIVE_REF.get)
+        _live_cache.update(t=time.monotonic(), v=data)
+        return data
+
+# --- FORECAST CACHE ---
+# Dashboards poll diagnostics and decision in lockstep; both reuse one prediction per history key
+PRED_CACHE_TTL = 2.0
+_pred_cache = {"key": None, "ts": 0.0, "y": None, "input_row": None}
+# Serializes forecasts: the scratch buffer is shared and concurrent callers should hit the cache
+_forecast_lock = threading.Lock()
+
+def _get_forecast():
+    """Returns (y_pred, input_row) for the latest history window, or None if data is insufficient."""
+    with _forecast_lock:
+        return _compute_forecast()
+
+def _compute_forecast():
+    now = time.monotonic()
+    if _pred_cache["key"] is not None and now - _pred_cache["ts"] < PRED_CACHE_TTL:
+        return _pred_cache["y"], _pred_cache["input_row"]
+
+    snapshot = HIST_REF.order_by_key().limit_to_last(60).get()
+    if not snapshot or len(snapshot) < 10: return None
+
+    items = sorted(snapshot.items())
+    latest_key = items[-1][0]
+    if latest_key == _pred_cache["key"]:
+        _pred_cache["ts"] = now
+        return _pred_cache["y"], _pred_cache["input_row"]
+
+    df = pd.DataFrame([v for _, v in items])
+    input_row = process_historical_data(df, ai_resources['feat_index'], ai_resources['scratch'])
+    y_pred = float(ai_resources['model'].predict(input_row)[0])
+
+    _pred_cache.update(key=latest_key, ts=now, y=y_pred, input_row=input_row)
+    return y_pred, input_row
+
+# Last decision/forecast pushed to decision_logs, kept in memory instead of re-read from Firebase.
+# This state is per process: it assumes a single uvicorn worker (N workers would each log a change once).
+_last_logged = {"decision": None, "forecast": None}
+# Guards the check-and-claim of _last_logged so concurrent decision calls cannot log the same change twice
+_log_lock = asyncio.Lock()
+
 # --- AI DOCTOR MODULE ---
 def evaluate_system_health(current_soil_frac, pump_state, ai_pred_frac):
     """
@@ -162,10 +299,10 @@ def evaluate_system_health(current_soil_frac, pump_state, ai_pred_frac):
 # 4. API ENDPOINTS
 
 @app.get("/api/v1/sensors/live")
-def get_live_status():
+async def get_live_status():
     """Returns live sensor data with CONNECTIVITY CHECK."""
     try:
-        data = db.reference('/sensors/greenhouse_1/live_status').get()
+        data = await _get_live_cached()
         
         is_fresh, diff = validate_data_freshness(data)
         if not is_fresh:
@@ -180,10 +317,9 @@ def get_live_status():
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/v1/sensors/history")
-def get_history(limit: int = 20):
+async def get_history(limit: int = 20):
     try:
-        ref = db.reference('/sensors/greenhouse_1/history_logs')
-        snapshot = ref.order_by_key().limit_to_last(limit).get()
+        snapshot = await asyncio.to_thread(lambda: HIST_REF.order_by_key().limit_to_last(limit).get())
         if not snapshot: return []
         data = [dict(v, id=k) for k, v in snapshot.items()]
         return data
@@ -191,26 +327,26 @@ def get_history(limit: int = 20):
         return []
 
 @app.get("/api/v1/system/diagnostics")
-def get_system_diagnostics():
+async def get_system_diagnostics():
     """NEW API: AI Doctor."""
     if 'model' not in ai_resources:
         raise HTTPException(status_code=503, detail="AI Model service not initialized")
 
     try:
-        ref_hist = db.reference('/sensors/greenhouse_1/history_logs')
-        snapshot = ref_hist.order_by_key().limit_to_last(60).get()
-        live_data = db.reference('/sensors/greenhouse_1/live_status').get() or {}
+        # Live status and history forecast are fetched concurrently; forecast errors surface only once the device is online
+        live_data, forecast = await asyncio.gather(asyncio.to_thread(LIVE_REF.get), asyncio.to_thread(_get_forecast),
+                                                   return_exceptions=True)
+        if isinstance(live_data, Exception): raise live_data
+        live_data = live_data or {}
 
         is_fresh, _ = validate_data_freshness(live_data)
         if not is_fresh:
              return {"health_status": "OFFLINE", "alerts": ["System offline"], "deviation_percent": 0}
 
-        if not snapshot or len(snapshot) < 10:
+        if isinstance(forecast, Exception): raise forecast
+        if forecast is None:
              return {"health_status": "WAITING_DATA", "alerts": []}
-
-        df = pd.DataFrame(list(snapshot.values()))
-        input_row = process_historical_data(df, ai_resources['features'])
-        y_pred = float(ai_resources['model'].predict(input_row)[0])
+        y_pred, _ = forecast
 
         curr_soil = float(live_data.get('soilPercent', 0)) / 100.0
         curr_pump = bool(live_data.get('pumpState', 0))
@@ -232,24 +368,25 @@ def get_system_diagnostics():
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/v1/irrigation/decision")
-def determine_irrigation_action():
+async def determine_irrigation_action():
     if 'model' not in ai_resources:
         raise HTTPException(status_code=503, detail="AI Model service not initialized")
 
     try:
-        ref_hist = db.reference('/sensors/greenhouse_1/history_logs')
-        snapshot = ref_hist.order_by_key().limit_to_last(60).get()
-        live_data = db.reference('/sensors/greenhouse_1/live_status').get() or {}
+        # Live status and history forecast are fetched concurrently; forecast errors surface only once the device is online
+        live_data, forecast = await asyncio.gather(asyncio.to_thread(LIVE_REF.get), asyncio.to_thread(_get_forecast),
+                                                   return_exceptions=True)
+        if isinstance(live_data, Exception): raise live_data
+        live_data = live_data or {}
 
         is_fresh, _ = validate_data_freshness(live_data)
         if not is_fresh:
             return {"decision": "OFFLINE", "reason": "Lost connection to device"}
 
-        if not snapshot or len(snapshot) < 10:
+        if isinstance(forecast, Exception): raise forecast
+        if forecast is None:
              return {"decision": "WAIT", "reason": "Collecting data..."}
-
-        df = pd.DataFrame(list(snapshot.values()))
-        input_row = process_historical_data(df, ai_resources['features'])
+        y_pred, _ = forecast
         
         curr_temp = float(live_data.get('temperature', 25))
         curr_humid = float(live_data.get('humidity', 70))
@@ -259,8 +396,6 @@ def determine_irrigation_action():
         dynamic_thr = compute_dynamic_threshold(current_vpd, POLICY_CONFIG)
         margin = POLICY_CONFIG["margin"]
         
-        y_pred = float(ai_resources['model'].predict(input_row)[0])
-        
         effective_threshold = dynamic_thr - margin
         
         # --- HUMAN READABLE REASONING (FRIENDLY ENGLISH) ---
@@ -289,22 +424,29 @@ def determine_irrigation_action():
         }
         
         # 1. ALWAYS UPDATE LIVE STATUS (For Dashboard)
-        db.reference('/sensors/greenhouse_1/live_status').update(update_payload)
+        updates = {f"{LIVE_PATH}/{k}": v for k, v in update_payload.items()}
 
         # 2. SMART LOGGING: Only push to logs if Decision or Forecast changes
-        prev_decision = live_data.get('ai_last_decision')
-        prev_forecast = live_data.get('ai_forecast_soil')
-        
-        # Handle case where prev_forecast is None (first run)
+        # Compare against what this process last logged (rounded, as stored)
+        forecast_val = update_payload["ai_forecast_soil"]
+        async with _log_lock:
+            prev_logged = dict(_last_logged)
+            should_log = (decision != prev_logged["decision"]) or (forecast_val != prev_logged["forecast"])
+            if should_log:
+                _last_logged.update(decision=decision, forecast=forecast_val)
+        if should_log:
+            updates[f"{DEC_PATH}/{generate_push_id()}"] = update_payload
+
+        # Both writes go out as one atomic multi-location update
         try:
-            prev_forecast_val = float(prev_forecast) if prev_forecast is not None else -1.0
-        except (ValueError, TypeError):
-            prev_forecast_val = -1.0
-
-        # Check: Did decision change? OR Did forecast change significantly?
-        # We compare rounded values to match what we store
-        if (decision != prev_decision) or (round(y_pred, 3) != prev_forecast_val):
-            db.reference('/sensors/greenhouse_1/decision_logs').push(update_payload)
+            await asyncio.to_thread(ROOT_REF.update, updates)
+        except Exception:
+            if should_log:
+                async with _log_lock:
+                    # Only roll back if no newer call has claimed the slot since
+                    if _last_logged == {"decision": decision, "forecast": forecast_val}:
+                        _last_logged.update(prev_logged)
+            raise
         
         return {
             "decision": decision,